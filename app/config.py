@@ -7,10 +7,10 @@ load_dotenv()
 APP_NAME = os.getenv("APP_NAME", "A2A registry")
 APP_VERSION = os.getenv("APP_VERSION", "0.1.0")
 APP_HOST = os.getenv("APP_HOST", "127.0.0.1")
-APP_PORT = os.getenv("APP_PORT", 9300)
+APP_PORT = int(os.getenv("APP_PORT", "9300"))
 
 # Logging
-DEBUG = bool(os.getenv("DEBUG", "False").lower() == "true")
+DEBUG = os.getenv("DEBUG", "False").lower() in ("true", "1", "yes")
 
 # CORS
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
@@ -1,5 +1,8 @@
+import atexit
 import logging
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener
 from app.config import APP_NAME, DEBUG
 
 
@@ -15,10 +18,18 @@ def init_logger():
     handler = logging.StreamHandler(sys.stderr)
     handler.setFormatter(formatter)
 
+    # Queue handler: callers only enqueue records, formatting and writes happen on the listener thread
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+
+    # Flush pending records and stop the listener thread once, at interpreter exit
+    atexit.register(listener.stop)
+
     # Root logger (uvicorn included)
     root_logger = logging.getLogger()
     root_logger.setLevel(level)
-    root_logger.handlers = [handler]
+    root_logger.handlers = [QueueHandler(log_queue)]
 
     # Stop verbose logger
     logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
@@ -29,8 +40,8 @@ def init_logger():
     logger = logging.getLogger(APP_NAME)
     logger.setLevel(level)
 
-    return logger
+    return logger, listener
 
 
 # Instance
-logger = init_logger()
+logger, log_listener = init_logger()
@@ -1,88 +1,195 @@
+from collections import defaultdict
 from contextlib import asynccontextmanager
 from typing import Annotated
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, HttpUrl, ValidationError
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, HttpUrl
 from app.config import APP_NAME, APP_VERSION, APP_HOST, APP_PORT, HEALTH_CHECK_INTERVAL, MAX_FAILURES, CORS_ORIGINS
 from app.logger import logger
 import uvicorn
 import asyncio
 import httpx
+import msgspec
+import orjson
 
 # In-memory store: {agent_url: agent_card_dict}
 agent_store: dict[str, dict] = {}
 
 # Consecutive failure counter per agent
-agent_failures: dict[str, int] = {}
+agent_failures: defaultdict[str, int] = defaultdict(int)
 
-# Lock to prevent race conditions on shared store
-_store_lock = asyncio.Lock()
+# Casefolded skill names, descriptions and tags per agent: {agent_url: search_blob}
+search_index: dict[str, str] = {}
 
+# Read-only view served by /agents and /discover, rebuilt on every store change: ((agent_url, card, search_blob), ...)
+_store_snapshot: tuple[tuple[str, dict, str], ...] = ()
 
-# Pydantic models
+
+# JSON responses rendered by orjson (FastAPI's own ORJSONResponse is deprecated)
+class ORJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+# Pydantic models (request binding)
 class RegisterRequest(BaseModel):
     url: HttpUrl
 
-class AgentSkill(BaseModel):
+
+# Agent card schema, validated by msgspec
+class AgentSkill(msgspec.Struct):
     name: str
     description: str = ""
     tags: list[str] = []
 
-class AgentCard(BaseModel):
+class AgentCard(msgspec.Struct):
     name: str
     description: str = ""
     skills: list[AgentSkill] = []
 
 
-# Periodically check if registered agents are still reachable
-# Deregisters agents after MAX_FAILURES consecutive failed checks
-async def _healthcheck_loop():
-    while True:
-        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+# Build the casefolded text searched by /discover from the card skills
+def _make_blob(card: dict) -> str:
+    return "\n".join(
+        text.casefold()
+        for s in card.get("skills", [])
+        for text in (s.get("name", ""), s.get("description", ""), *s.get("tags", []))
+    )
+
+
+# Rebuild the read-only snapshot after the store has changed
+def _refresh_snapshot():
+    global _store_snapshot
+    _store_snapshot = tuple((url, card, search_index[url]) for url, card in agent_store.items())
+
+
+# Add an agent to the store and its search index
+# Store mutations never await, so they run atomically on the event loop without a lock
+def _add_agent(url: str, card: dict):
+    agent_store[url] = card
+    agent_failures[url] = 0
+    search_index[url] = _make_blob(card)
+    _refresh_snapshot()
+
+
+# Remove an agent from the store and its search index
+def _remove_agent(url: str, refresh: bool = True):
+    agent_store.pop(url, None)
+    agent_failures.pop(url, None)
+    search_index.pop(url, None)
+    if refresh:
+        _refresh_snapshot()
+
+
+# Fetch the agent card of a single agent, returning whether it is reachable
+# Never raises, so one failing probe does not cancel the others in the TaskGroup
+async def _probe(client: httpx.AsyncClient, url: str, semaphore: asyncio.Semaphore) -> bool:
+    try:
+        async with semaphore:
+            async with asyncio.timeout(5.0):
+                resp = await client.get(f"{url}/.well-known/agent-card.json")
+                resp.raise_for_status()
+        return True
+    except Exception:
+        return False
+
+
+# Probe every registered agent once and update failure counters
+# Deregisters agents that reached MAX_FAILURES consecutive failed checks
+async def _healthcheck_cycle(client: httpx.AsyncClient, semaphore: asyncio.Semaphore):
+    agent_urls = list(agent_store)
+
+    if not agent_urls:
+        return
+
+    # Probe all agents concurrently, then apply the results in one pass with no await
+    async with asyncio.TaskGroup() as tg:
+        tasks = {url: tg.create_task(_probe(client, url, semaphore)) for url in agent_urls}
+
+    # Log lines are collected and emitted once the store is updated
+    failed: list[tuple[str, str, int, bool]] = []
 
-        async with _store_lock:
-            agent_urls = list(agent_store.keys())
+    for url, task in tasks.items():
+        # Agent unregistered while being probed
+        if url not in agent_store:
+            continue
 
-        if not agent_urls:
+        if task.result():
+            # Agent is alive: reset failure counter
+            agent_failures[url] = 0
             continue
 
-        async with httpx.AsyncClient() as client:
-            for url in agent_urls:
-                try:
-                    resp = await client.get(f"{url}/.well-known/agent-card.json", timeout=5.0)
-                    resp.raise_for_status()
+        agent_failures[url] += 1
+        failures = agent_failures[url]
+        deregistered = failures >= MAX_FAILURES
+        name = url
+
+        if deregistered:
+            try:
+                name = agent_store[url]["name"]
+            except KeyError:
+                pass
+            _remove_agent(url, refresh=False)
+
+        failed.append((url, name, failures, deregistered))
+
+    # Rebuild the snapshot once for all the agents deregistered in this cycle
+    if any(deregistered for *_, deregistered in failed):
+        _refresh_snapshot()
+
+    for url, name, failures, deregistered in failed:
+        if deregistered:
+            logger.info(f"Agent '{name}' at {url} deregistered (unreachable after {MAX_FAILURES} checks)")
+        else:
+            logger.info(f"Agent {url} healthcheck failed ({failures}/{MAX_FAILURES})")
 
-                    # Agent is alive: reset failure counter
-                    async with _store_lock:
-                        agent_failures[url] = 0
 
-                except Exception:
-                    async with _store_lock:
-                        agent_failures[url] = agent_failures.get(url, 0) + 1
-                        if agent_failures[url] >= MAX_FAILURES:
-                            name = agent_store.get(url, {}).get("name", url)
-                            agent_store.pop(url, None)
-                            agent_failures.pop(url, None)
+# Periodically check if registered agents are still reachable
+async def _healthcheck_loop(client: httpx.AsyncClient):
+    # Cycles are scheduled on fixed deadlines, so probe time does not stretch the interval
+    loop = asyncio.get_running_loop()
+    next_check = loop.time()
+
+    # Bound concurrent probes when many agents are registered
+    # Created here so it is bound to the loop running the healthcheck
+    semaphore = asyncio.Semaphore(64)
+
+    while True:
+        next_check += HEALTH_CHECK_INTERVAL
+        delay = next_check - loop.time()
+
+        # A cycle ran longer than the interval: skip the missed deadlines instead of piling up
+        if delay < 0:
+            next_check -= delay
+            delay = 0
 
-                            logger.info(f"Agent '{name}' at {url} deregistered (unreachable after {MAX_FAILURES} checks)")
-                        else:
-                            logger.info(f"Agent {url} healthcheck failed ({agent_failures[url]}/{MAX_FAILURES})")
+        await asyncio.sleep(delay)
+        await _healthcheck_cycle(client, semaphore)
 
 
 # App lifespan
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    task = asyncio.create_task(_healthcheck_loop())
+    # Shared HTTP client: keeps connections alive across registrations and healthchecks
+    # HTTP/2 multiplexes concurrent probes to agents behind the same host over one connection
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100),
+    )
+    task = asyncio.create_task(_healthcheck_loop(app.state.http))
     logger.debug(f"Healthcheck started (interval={HEALTH_CHECK_INTERVAL}s, max_failures={MAX_FAILURES})")
     print_banner()
     yield
     task.cancel()
+    await app.state.http.aclose()
 
 
 # App init
 app = FastAPI(
     title=APP_NAME,
     version=APP_VERSION,
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -96,16 +203,21 @@ app.add_middleware(
 )
 
 
+# Shared HTTP client created in the app lifespan
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    return request.app.state.http
+
+
 # Registry health status
+# Kept async (a sync route would be dispatched to the threadpool) and returned as a
+# response to skip jsonable_encoder, since load balancers hit it at high rate
 @app.get("/")
 async def health():
-    async with _store_lock:
-        count = len(agent_store)
-    return {
+    return ORJSONResponse({
         "status": "ok",
-        "agents": count,
+        "agents": len(agent_store),
         "check_interval": HEALTH_CHECK_INTERVAL,
-    }
+    })
 
 
 # Register an agent by fetching its Agent Card from the well-known endpoint
@@ -113,28 +225,26 @@ async def health():
     502: {"description": "Failed to fetch agent card from the agent's well-known endpoint"},
     422: {"description": "Invalid URL or agent card structure"},
 })
-async def register_agent(request: RegisterRequest):
+async def register_agent(request: RegisterRequest, client: Annotated[httpx.AsyncClient, Depends(get_http_client)]):
     agent_url = str(request.url).rstrip("/")
     card_url = f"{agent_url}/.well-known/agent-card.json"
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(card_url, timeout=10.0)
-            response.raise_for_status()
-        except httpx.HTTPError as e:
-            raise HTTPException(status_code=502, detail=f"Failed to fetch agent card from {card_url}: {e}")
+    try:
+        response = await client.get(card_url, timeout=10.0)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Failed to fetch agent card from {card_url}: {e}")
 
     # Validate agent card structure
+    # The raw card is validated in place and stored as is, with no dump round-trip
+    # Decoded by orjson so stored cards stay serializable by it (integers above 64 bits become floats)
     try:
-        agent_card = AgentCard(**response.json())
-    except ValidationError as e:
-        raise HTTPException(status_code=422, detail=f"Invalid agent card: {e.errors()}")
+        card_dict = orjson.loads(response.content)
+        agent_card = msgspec.convert(card_dict, AgentCard)
+    except (orjson.JSONDecodeError, msgspec.ValidationError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid agent card: {e}")
 
-    card_dict = agent_card.model_dump()
-
-    async with _store_lock:
-        agent_store[agent_url] = card_dict
-        agent_failures[agent_url] = 0
+    _add_agent(agent_url, card_dict)
 
     logger.info(f"Agent '{agent_card.name}' registered at {agent_url}")
 
@@ -147,33 +257,24 @@ async def register_agent(request: RegisterRequest):
 # Discover agents by skill tag. Searches skill names, descriptions, and tags
 @app.get("/discover")
 async def discover_agents(skill: Annotated[str, Query(description="Skill tag to search for")]):
-    skill_lower = skill.lower()
-    results = []
-
-    async with _store_lock:
-        store_snapshot = dict(agent_store)
-
-    for url, card in store_snapshot.items():
-        for s in card.get("skills", []):
-            tags = [t.lower() for t in s.get("tags", [])]
-            name = s.get("name", "").lower()
-            description = s.get("description", "").lower()
+    skill_folded = skill.casefold()
 
-            if skill_lower in tags or skill_lower in name or skill_lower in description:
-                results.append({"url": url, "card": card})
-                break
-
-    return results
+    # Returned as a response to skip jsonable_encoder on the (possibly large) card list
+    return ORJSONResponse([
+        {"url": url, "card": card}
+        for url, card, blob in _store_snapshot
+        # Agents without skills have an empty blob and never match
+        if blob and skill_folded in blob
+    ])
 
 
 # List all registered agents
 @app.get("/agents")
 async def list_agents():
-    async with _store_lock:
-        return [
-            {"url": url, "card": card}
-            for url, card in agent_store.items()
-        ]
+    return ORJSONResponse([
+        {"url": url, "card": card}
+        for url, card, _ in _store_snapshot
+    ])
 
 
 # Remove an agent from the registry
@@ -181,12 +282,10 @@ async def list_agents():
 async def unregister_agent(url: Annotated[str, Query(description="Agent URL to remove")]):
     agent_url = url.rstrip("/")
 
-    async with _store_lock:
-        if agent_url not in agent_store:
-            raise HTTPException(status_code=404, detail="Agent not found")
+    if agent_url not in agent_store:
+        raise HTTPException(status_code=404, detail="Agent not found")
 
-        del agent_store[agent_url]
-        agent_failures.pop(agent_url, None)
+    _remove_agent(agent_url)
 
     return {
         "status": "unregistered",
@@ -195,20 +294,24 @@ async def unregister_agent(url: Annotated[str, Query(description="Agent URL to r
 
 
 # Banner
+_BANNER = "\n".join([
+    "####################################################################",
+    "#            ___                            _     _                #",
+    "#      /\\   |__ \\    /\\                    (_)   | |               #",
+    "#     /  \\     ) |  /  \\     _ __ ___  __ _ _ ___| |_ _ __ _   _   #",
+    "#    / /\\ \\   / /  / /\\ \\   | '__/ _ \\/ _` | / __| __| '__| | | |  #",
+    "#   / ____ \\ / /_ / ____ \\  | | |  __/ (_| | \\__ \\ |_| |  | |_| |  #",
+    "#  /_/    \\_\\____/_/    \\_\\ |_|  \\___|\\__, |_|___/\\__|_|   \\__, |  #",
+    "#                                      __/ |                __/ |  #",
+    "#                                     |___/                |___/   #",
+    "#                                                                  #",
+    "#              alessandro.orru <at> aleostudio.com                 #",
+    "#                                                                  #",
+    "####################################################################",
+])
+
 def print_banner():
-    logger.info("####################################################################")
-    logger.info("#            ___                            _     _                #")
-    logger.info("#      /\\   |__ \\    /\\                    (_)   | |               #")
-    logger.info("#     /  \\     ) |  /  \\     _ __ ___  __ _ _ ___| |_ _ __ _   _   #")
-    logger.info("#    / /\\ \\   / /  / /\\ \\   | '__/ _ \\/ _` | / __| __| '__| | | |  #")
-    logger.info("#   / ____ \\ / /_ / ____ \\  | | |  __/ (_| | \\__ \\ |_| |  | |_| |  #")
-    logger.info("#  /_/    \\_\\____/_/    \\_\\ |_|  \\___|\\__, |_|___/\\__|_|   \\__, |  #")
-    logger.info("#                                      __/ |                __/ |  #")
-    logger.info("#                                     |___/                |___/   #")
-    logger.info("#                                                                  #")
-    logger.info("#              alessandro.orru <at> aleostudio.com                 #")
-    logger.info("#                                                                  #")
-    logger.info("####################################################################")
+    logger.info("\n" + _BANNER)
 
 
 # App launch if invoked directly
@@ -1,7 +1,13 @@
+import asyncio
+import logging
+import time
 import httpx
+import orjson
 from unittest.mock import AsyncMock, patch, MagicMock
 from fastapi.testclient import TestClient
-from app.main import app, agent_store, agent_failures
+from app.main import app, agent_store, agent_failures, search_index, MAX_FAILURES
+from app.logger import logger, log_listener
+from app.main import _add_agent, _remove_agent, _refresh_snapshot, _probe, _healthcheck_cycle
 
 client = TestClient(app)
 
@@ -23,6 +29,31 @@ VALID_CARD = {
 def setup_function():
     agent_store.clear()
     agent_failures.clear()
+    search_index.clear()
+    _refresh_snapshot()
+
+
+# App lifespan
+################################################################################
+
+def test_lifespan_runs_twice():
+    handler = MagicMock(level=logging.NOTSET)
+
+    with patch.object(log_listener, "handlers", (handler,)):
+        for _ in range(2):
+            with TestClient(app) as lifespan_client:
+                assert lifespan_client.get("/").status_code == 200
+
+            logger.info("between lifespans")
+
+        # Records are still written by the listener thread after every shutdown
+        deadline = time.monotonic() + 2
+        while handler.handle.call_count < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    messages = [call.args[0].getMessage() for call in handler.handle.call_args_list]
+    assert messages.count("between lifespans") == 2
+    assert sum("####" in message for message in messages) == 2
 
 
 # GET /
@@ -39,7 +70,7 @@ def test_health_check():
 
 
 def test_health_check_with_agents():
-    agent_store["https://example.com"] = VALID_CARD
+    _add_agent("https://example.com", VALID_CARD)
     response = client.get("/")
     data = response.json()
     assert data["agents"] == 1
@@ -48,17 +79,12 @@ def test_health_check_with_agents():
 # POST /register
 ################################################################################
 
-@patch("app.main.httpx.AsyncClient")
-def test_register_success(mock_client_cls):
+@patch.object(app.state, "http", new_callable=AsyncMock, create=True)
+def test_register_success(mock_client):
     mock_response = MagicMock()
-    mock_response.json.return_value = VALID_CARD
+    mock_response.content = orjson.dumps(VALID_CARD)
     mock_response.raise_for_status = MagicMock()
-
-    mock_client = AsyncMock()
     mock_client.get.return_value = mock_response
-    mock_client.__aenter__ = AsyncMock(return_value=mock_client)
-    mock_client.__aexit__ = AsyncMock(return_value=False)
-    mock_client_cls.return_value = mock_client
 
     response = client.post("/register", json={"url": "https://example.com"})
     assert response.status_code == 200
@@ -66,38 +92,58 @@ def test_register_success(mock_client_cls):
     data = response.json()
     assert data["status"] == "registered"
     assert data["agent"] == "Test Agent"
-    assert "https://example.com" in agent_store
+    assert agent_store["https://example.com"] == VALID_CARD
+
+
+@patch.object(app.state, "http", new_callable=AsyncMock, create=True)
+def test_register_card_with_big_integer(mock_client):
+    mock_response = MagicMock()
+    mock_response.content = b'{"name": "Big Agent", "version": 123456789012345678901234567890}'
+    mock_response.raise_for_status = MagicMock()
+    mock_client.get.return_value = mock_response
+
+    response = client.post("/register", json={"url": "https://example.com"})
+    assert response.status_code == 200
+
+    response = client.get("/agents")
+    assert response.status_code == 200
+    assert response.json()[0]["card"]["name"] == "Big Agent"
 
 
-def test_register_invalid_url():
+@patch.object(app.state, "http", new_callable=AsyncMock, create=True)
+def test_register_invalid_url(mock_client):
     response = client.post("/register", json={"url": "not-a-valid-url"})
     assert response.status_code == 422
+    mock_client.get.assert_not_called()
 
 
-@patch("app.main.httpx.AsyncClient")
-def test_register_unreachable(mock_client_cls):
-    mock_client = AsyncMock()
+@patch.object(app.state, "http", new_callable=AsyncMock, create=True)
+def test_register_unreachable(mock_client):
     mock_client.get.side_effect = httpx.ConnectError("Connection refused")
-    mock_client.__aenter__ = AsyncMock(return_value=mock_client)
-    mock_client.__aexit__ = AsyncMock(return_value=False)
-    mock_client_cls.return_value = mock_client
 
     response = client.post("/register", json={"url": "https://unreachable.example.com"})
     assert response.status_code == 502
     assert "Failed to fetch agent card" in response.json()["detail"]
 
 
-@patch("app.main.httpx.AsyncClient")
-def test_register_invalid_card(mock_client_cls):
+@patch.object(app.state, "http", new_callable=AsyncMock, create=True)
+def test_register_invalid_card(mock_client):
     mock_response = MagicMock()
-    mock_response.json.return_value = {"invalid": "card"}  # missing "name"
+    mock_response.content = orjson.dumps({"invalid": "card"})  # missing "name"
     mock_response.raise_for_status = MagicMock()
+    mock_client.get.return_value = mock_response
 
-    mock_client = AsyncMock()
+    response = client.post("/register", json={"url": "https://example.com"})
+    assert response.status_code == 422
+    assert "Invalid agent card" in response.json()["detail"]
+
+
+@patch.object(app.state, "http", new_callable=AsyncMock, create=True)
+def test_register_malformed_card(mock_client):
+    mock_response = MagicMock()
+    mock_response.content = b"<html>not json</html>"
+    mock_response.raise_for_status = MagicMock()
     mock_client.get.return_value = mock_response
-    mock_client.__aenter__ = AsyncMock(return_value=mock_client)
-    mock_client.__aexit__ = AsyncMock(return_value=False)
-    mock_client_cls.return_value = mock_client
 
     response = client.post("/register", json={"url": "https://example.com"})
     assert response.status_code == 422
@@ -114,7 +160,7 @@ def test_agents_empty():
 
 
 def test_agents_with_data():
-    agent_store["https://example.com"] = VALID_CARD
+    _add_agent("https://example.com", VALID_CARD)
 
     response = client.get("/agents")
     assert response.status_code == 200
@@ -129,7 +175,7 @@ def test_agents_with_data():
 ################################################################################
 
 def test_discover_match_by_tag():
-    agent_store["https://example.com"] = VALID_CARD
+    _add_agent("https://example.com", VALID_CARD)
 
     response = client.get("/discover", params={"skill": "translate"})
     assert response.status_code == 200
@@ -140,7 +186,7 @@ def test_discover_match_by_tag():
 
 
 def test_discover_match_by_name():
-    agent_store["https://example.com"] = VALID_CARD
+    _add_agent("https://example.com", VALID_CARD)
 
     response = client.get("/discover", params={"skill": "translation"})
     assert response.status_code == 200
@@ -148,7 +194,7 @@ def test_discover_match_by_name():
 
 
 def test_discover_match_by_description():
-    agent_store["https://example.com"] = VALID_CARD
+    _add_agent("https://example.com", VALID_CARD)
 
     response = client.get("/discover", params={"skill": "translates"})
     assert response.status_code == 200
@@ -156,21 +202,40 @@ def test_discover_match_by_description():
 
 
 def test_discover_case_insensitive():
-    agent_store["https://example.com"] = VALID_CARD
+    _add_agent("https://example.com", VALID_CARD)
 
     response = client.get("/discover", params={"skill": "TRANSLATE"})
     assert response.status_code == 200
     assert len(response.json()) == 1
 
 
+def test_discover_unicode_case_insensitive():
+    _add_agent("https://example.com", {
+        "name": "Street Agent",
+        "skills": [{"name": "Straße lookup", "tags": ["maps"]}],
+    })
+
+    response = client.get("/discover", params={"skill": "STRASSE"})
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+
+
 def test_discover_no_match():
-    agent_store["https://example.com"] = VALID_CARD
+    _add_agent("https://example.com", VALID_CARD)
 
     response = client.get("/discover", params={"skill": "nonexistent"})
     assert response.status_code == 200
     assert response.json() == []
 
 
+def test_discover_skips_agents_without_skills():
+    _add_agent("https://example.com", {"name": "No Skills Agent", "skills": []})
+
+    response = client.get("/discover", params={"skill": ""})
+    assert response.status_code == 200
+    assert response.json() == []
+
+
 def test_discover_empty_store():
     response = client.get("/discover", params={"skill": "anything"})
     assert response.status_code == 200
@@ -181,7 +246,7 @@ def test_discover_empty_store():
 ################################################################################
 
 def test_unregister_success():
-    agent_store["https://example.com"] = VALID_CARD
+    _add_agent("https://example.com", VALID_CARD)
     agent_failures["https://example.com"] = 0
 
     response = client.delete("/unregister", params={"url": "https://example.com"})
@@ -192,6 +257,7 @@ def test_unregister_success():
     assert data["url"] == "https://example.com"
     assert "https://example.com" not in agent_store
     assert "https://example.com" not in agent_failures
+    assert "https://example.com" not in search_index
 
 
 def test_unregister_not_found():
@@ -199,3 +265,83 @@ def test_unregister_not_found():
     assert response.status_code == 404
     assert response.json()["detail"] == "Agent not found"
 
+
+# Healthcheck
+################################################################################
+
+def test_probe_reachable():
+    mock_response = MagicMock()
+    mock_response.raise_for_status = MagicMock()
+
+    mock_client = AsyncMock()
+    mock_client.get.return_value = mock_response
+
+    assert asyncio.run(_probe(mock_client, "https://example.com", asyncio.Semaphore(1))) is True
+    mock_client.get.assert_called_once_with("https://example.com/.well-known/agent-card.json")
+
+
+def test_probe_unreachable():
+    mock_client = AsyncMock()
+    mock_client.get.side_effect = httpx.ConnectError("Connection refused")
+
+    assert asyncio.run(_probe(mock_client, "https://example.com", asyncio.Semaphore(1))) is False
+
+
+# Run healthcheck cycles on a fresh event loop
+def run_healthcheck_cycles(count: int):
+    async def run():
+        semaphore = asyncio.Semaphore(64)
+        for _ in range(count):
+            await _healthcheck_cycle(AsyncMock(), semaphore)
+
+    asyncio.run(run())
+
+
+@patch("app.main._probe", new_callable=AsyncMock, return_value=False)
+def test_healthcheck_counts_failures(mock_probe):
+    _add_agent("https://example.com", VALID_CARD)
+
+    run_healthcheck_cycles(1)
+    assert agent_failures["https://example.com"] == 1
+    assert "https://example.com" in agent_store
+
+
+@patch("app.main._probe", new_callable=AsyncMock, return_value=True)
+def test_healthcheck_resets_failures_on_success(mock_probe):
+    _add_agent("https://example.com", VALID_CARD)
+    agent_failures["https://example.com"] = MAX_FAILURES - 1
+
+    run_healthcheck_cycles(1)
+    assert agent_failures["https://example.com"] == 0
+    assert "https://example.com" in agent_store
+
+
+@patch("app.main._probe", new_callable=AsyncMock, return_value=False)
+def test_healthcheck_deregisters_after_max_failures(mock_probe):
+    _add_agent("https://example.com", VALID_CARD)
+    _add_agent("https://other.example.com", VALID_CARD)
+
+    run_healthcheck_cycles(MAX_FAILURES - 1)
+    assert len(client.get("/agents").json()) == 2
+
+    run_healthcheck_cycles(1)
+    assert agent_store == {}
+    assert search_index == {}
+    assert "https://example.com" not in agent_failures
+    assert client.get("/agents").json() == []
+    assert client.get("/discover", params={"skill": "translate"}).json() == []
+
+
+@patch("app.main._probe", new_callable=AsyncMock)
+def test_healthcheck_skips_agent_unregistered_mid_probe(mock_probe):
+    _add_agent("https://example.com", VALID_CARD)
+
+    async def unregister_during_probe(client, url, semaphore):
+        _remove_agent(url)
+        return False
+
+    mock_probe.side_effect = unregister_during_probe
+
+    run_healthcheck_cycles(1)
+    assert "https://example.com" not in agent_failures
+    assert "https://example.com" not in agent_store